@@ -0,0 +1,270 @@
+
+# cassette.py
+import os
+import sys
+import gzip
+import json
+import time
+import base64
+import threading
+from collections import defaultdict, deque
+from typing import List, Dict, Any
+import requests
+import qualtrics_api
+
+
+CASSETTE_VERSION = 3
+
+
+class CassetteMissError(LookupError):
+    """Raised in replay mode when a request has no matching recorded interaction."""
+
+
+def _canonical(value: Any) -> str:
+    return json.dumps(value, sort_keys=True, default=str)
+
+
+def _rebuild_error(error: Dict) -> Exception:
+    """Recreates a recorded exception with its original type.
+
+    The type is looked up by module and qualified name among the loaded modules, so requests and openai
+    errors are raised as themselves. Types whose constructor needs more than a message (such as
+    openai.RateLimitError) are created with the message only; unknown types become RuntimeError.
+    """
+    error_type = sys.modules.get(error["module"])
+    for part in error["type"].split("."):
+        error_type = getattr(error_type, part, None)
+    if not (isinstance(error_type, type) and issubclass(error_type, Exception)):
+        return RuntimeError(f"{error['module']}.{error['type']}: {error['message']}")
+    try:
+        return error_type(error["message"])
+    except Exception:
+        exc = error_type.__new__(error_type)
+        Exception.__init__(exc, error["message"])
+        exc.message = error["message"]
+        return exc
+
+
+class CassetteResponse:
+    """Stands in for requests.Response when replaying recorded Qualtrics traffic."""
+
+    def __init__(self, status_code: int, content: bytes):
+        self.status_code = status_code
+        self.content = content
+        self.text = content.decode("utf-8", errors="replace")
+
+    def json(self):
+        return json.loads(self.text)
+
+    def raise_for_status(self) -> None:
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} Error: {self.text}", response=self)
+
+
+class _ChainProxy:
+    """Wraps an LLMChain so that invoke() goes through the cassette; other attributes pass through."""
+
+    def __init__(self, cassette: "Cassette", chain):
+        self._cassette = cassette
+        self._chain = chain
+
+    def __getattr__(self, name):
+        return getattr(self._chain, name)
+
+    def invoke(self, inputs: Dict, *args, **kwargs) -> Dict:
+        return self._cassette.interact(
+            "chain", self._chain.output_key, inputs,
+            lambda: self._encode_chain_output(self._chain.invoke(inputs, *args, **kwargs)),
+            lambda recorded: recorded
+        )
+
+    @staticmethod
+    def _encode_chain_output(output: Dict) -> Dict:
+        # Only keep JSON-serializable values (the chain's inputs and its output text)
+        return {key: value for key, value in output.items() if isinstance(value, (str, int, float, bool, type(None)))}
+
+
+class _RequestsProxy:
+    """Replaces the requests module inside qualtrics_api so every HTTP call goes through the cassette."""
+
+    def __init__(self, cassette: "Cassette", requests_module):
+        self._cassette = cassette
+        self._requests = requests_module
+
+    def __getattr__(self, name):
+        return getattr(self._requests, name)
+
+    def request(self, method: str, url: str, **kwargs):
+        request = {"method": method.upper(), "url": url}
+        if "json" in kwargs:
+            request["json"] = kwargs["json"]
+        if "data" in kwargs:
+            request["data"] = kwargs["data"]
+        if "files" in kwargs:
+            # Match uploads by file name only; the file content is not stored
+            request["files"] = {field: spec[0] for field, spec in kwargs["files"].items()}
+
+        def live():
+            response = getattr(self._requests, method.lower())(url, **kwargs)
+            return {"status": response.status_code, "body": base64.b64encode(response.content).decode("ascii")}
+
+        return self._cassette.interact(
+            "http", f"{method.upper()} {url}", request, live,
+            lambda recorded: CassetteResponse(recorded["status"], base64.b64decode(recorded["body"]))
+        )
+
+    def get(self, url: str, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def put(self, url: str, **kwargs):
+        return self.request("PUT", url, **kwargs)
+
+    def delete(self, url: str, **kwargs):
+        return self.request("DELETE", url, **kwargs)
+
+
+class _TimeProxy:
+    """Replaces the time module inside qualtrics_api in replay mode, so polling delays follow the replay speed."""
+
+    def __init__(self, cassette: "Cassette", time_module):
+        self._cassette = cassette
+        self._time = time_module
+
+    def __getattr__(self, name):
+        return getattr(self._time, name)
+
+    def sleep(self, seconds: float) -> None:
+        if self._cassette.speed:
+            self._time.sleep(seconds / self._cassette.speed)
+
+
+class Cassette:
+    """Records or replays every chain invocation and QualtricsAPI HTTP exchange of a run.
+
+    mode="record" calls the live services and stores each interaction with its latency in a gzipped JSON
+    lines file. mode="replay" serves the recorded interactions back without touching the network:
+    speed=None replays instantly, speed=1.0 at recorded latency, speed=10.0 ten times faster. The same
+    scaling applies to the polling delays of QualtricsAPI.export_responses.
+
+    Interactions are matched on their kind, name and canonical request, in recorded order. With
+    strict=False a request that was never recorded (e.g. because an optimization changed a prompt input)
+    falls back to the next unused interaction with the same kind and name.
+
+    Use as a context manager around code that uses the chains of the given modules:
+
+        with Cassette("run.cassette.gz", mode="record", modules=[qualsurv]):
+            qualsurv.generate_personalized_survey(responses)
+    """
+
+    def __init__(self, path: str, mode: str = "replay", modules: List = None, speed: float = None,
+                 strict: bool = True):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Unknown cassette mode: {mode}")
+        self.path = path
+        self.mode = mode
+        self.modules = modules or []
+        self.speed = speed
+        self.strict = strict
+        self._lock = threading.Lock()
+        self._patches = []
+        self._file = None
+        self.stats: Dict[str, Dict[str, float]] = defaultdict(lambda: {"Calls": 0, "Recorded_Seconds": 0.0,
+                                                                      "Seconds": 0.0})
+
+        if mode == "replay":
+            self._by_request = defaultdict(deque)
+            self._by_name = defaultdict(deque)
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                header = json.loads(f.readline())
+                if header.get("version") != CASSETTE_VERSION:
+                    raise ValueError(f"Unsupported cassette version: {header.get('version')}")
+                for line in f:
+                    entry = json.loads(line)
+                    self._by_request[(entry["kind"], entry["name"], _canonical(entry["request"]))].append(entry)
+                    self._by_name[(entry["kind"], entry["name"])].append(entry)
+            self._used = set()
+
+    def __enter__(self) -> "Cassette":
+        if self.mode == "record":
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._file = gzip.open(self.path, "wt", encoding="utf-8")
+            self._file.write(json.dumps({"version": CASSETTE_VERSION, "recorded_at": time.time()}) + "\n")
+
+        self._patch(qualtrics_api, "requests", _RequestsProxy(self, qualtrics_api.requests))
+        if self.mode == "replay":
+            self._patch(qualtrics_api, "time", _TimeProxy(self, qualtrics_api.time))
+        for module in self.modules:
+            for name, value in list(vars(module).items()):
+                if name.endswith("_chain") and hasattr(value, "invoke"):
+                    self._patch(module, name, _ChainProxy(self, value))
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        for module, name, original in reversed(self._patches):
+            setattr(module, name, original)
+        self._patches = []
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _patch(self, module, name: str, replacement) -> None:
+        self._patches.append((module, name, getattr(module, name)))
+        setattr(module, name, replacement)
+
+    def interact(self, kind: str, name: str, request: Dict, live, decode):
+        """Runs one interaction: live() in record mode, the matching recorded entry in replay mode."""
+        if self.mode == "record":
+            start = time.perf_counter()
+            entry = {"kind": kind, "name": name, "request": json.loads(_canonical(request))}
+            try:
+                entry["response"] = live()
+            except Exception as e:
+                entry["error"] = {"module": type(e).__module__, "type": type(e).__qualname__, "message": str(e)}
+                self._record(kind, name, entry, start)
+                raise
+            self._record(kind, name, entry, start)
+            return decode(entry["response"])
+
+        start = time.perf_counter()
+        entry = self._next_entry(kind, name, request)
+        if self.speed:
+            time.sleep(entry["elapsed"] / self.speed)
+        self._count(kind, name, entry["elapsed"], time.perf_counter() - start)
+        if "error" in entry:
+            raise _rebuild_error(entry["error"])
+        return decode(entry["response"])
+
+    def _record(self, kind: str, name: str, entry: Dict, start: float) -> None:
+        entry["elapsed"] = round(time.perf_counter() - start, 4)
+        with self._lock:
+            self._file.write(json.dumps(entry) + "\n")
+        self._count(kind, name, entry["elapsed"], entry["elapsed"])
+
+    def _next_entry(self, kind: str, name: str, request: Dict) -> Dict:
+        with self._lock:
+            for queue in (self._by_request[(kind, name, _canonical(request))],
+                          None if self.strict else self._by_name[(kind, name)]):
+                while queue:
+                    entry = queue.popleft()
+                    if id(entry) not in self._used:
+                        self._used.add(id(entry))
+                        return entry
+        raise CassetteMissError(f"No recorded {kind} interaction for {name}: {_canonical(request)[:200]}")
+
+    def _count(self, kind: str, name: str, recorded: float, elapsed: float) -> None:
+        with self._lock:
+            stats = self.stats[f"{kind} {name}"]
+            stats["Calls"] += 1
+            stats["Recorded_Seconds"] += recorded
+            stats["Seconds"] += elapsed
+
+    def report(self) -> Dict[str, Dict[str, float]]:
+        """Prints and returns calls, recorded latency and latency of this run per interaction name."""
+        print(f"### Cassette {self.mode}: {self.path} ###")
+        for name, stats in sorted(self.stats.items()):
+            print(f"{name}: {stats['Calls']} calls, {stats['Recorded_Seconds']:.2f}s recorded, "
+                  f"{stats['Seconds']:.2f}s this run")
+        return dict(self.stats)
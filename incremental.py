@@ -0,0 +1,74 @@
+
+# incremental.py
+from typing import List, Dict, Tuple, Iterable
+
+
+# Pair lists of a generated survey; each pair dict carries its source "Activity"
+PAIR_KEYS = ["Stressful_vs_Relaxing_Pairs", "Solitary_vs_Social_Pairs"]
+
+# Per-question lists of a generated survey, all aligned with Survey_Questions
+QUESTION_KEYS = ["Survey_Questions", "Question_Pair_Types", "Question_Option_A_Poles", "Question_Activities",
+                 "Question_IDs", "Question_Tags"]
+
+
+def survey_activities(survey: Dict) -> List[str]:
+    """Returns the activities a survey was generated from.
+
+    Results from before Activities was recorded fall back to the activities of their questions.
+    """
+    if survey.get("Activities"):
+        return list(survey["Activities"])
+    activities = []
+    seen = set()
+    for activity in survey.get("Question_Activities", []):
+        if activity.lower() not in seen:
+            seen.add(activity.lower())
+            activities.append(activity)
+    return activities
+
+
+def diff_activities(previous: List[str], current: List[str]) -> Tuple[List[str], List[str]]:
+    """Returns (added, removed) activities between two extractions, compared case-insensitively."""
+    previous_keys = {activity.lower() for activity in previous}
+    current_keys = {activity.lower() for activity in current}
+    added = [activity for activity in current if activity.lower() not in previous_keys]
+    removed = [activity for activity in previous if activity.lower() not in current_keys]
+    return added, removed
+
+
+def drop_activities(survey: Dict, removed: Iterable[str]) -> Tuple[Dict, List[int]]:
+    """Removes the pairs and questions generated for the given activities.
+
+    Returns the reduced survey and the positions of the dropped questions in the original survey.
+    """
+    removed_keys = {activity.lower() for activity in removed}
+    question_activities = survey.get("Question_Activities", [])
+    dropped = [idx for idx, activity in enumerate(question_activities) if activity.lower() in removed_keys]
+    dropped_set = set(dropped)
+
+    reduced = dict(survey)
+    reduced["Activities"] = [a for a in survey_activities(survey) if a.lower() not in removed_keys]
+    for key in PAIR_KEYS:
+        reduced[key] = [pair for pair in survey.get(key, []) if pair.get("Activity", "").lower() not in removed_keys]
+    for key in QUESTION_KEYS:
+        if key in survey:
+            reduced[key] = [value for idx, value in enumerate(survey[key]) if idx not in dropped_set]
+    return reduced, dropped
+
+
+def merge_surveys(base: Dict, addition: Dict) -> Dict:
+    """Appends the activities, pairs and questions of addition to base."""
+    merged = dict(base)
+    for key in ["Activities"] + PAIR_KEYS + QUESTION_KEYS:
+        if key in base or key in addition:
+            merged[key] = list(base.get(key, [])) + list(addition.get(key, []))
+    return merged
+
+
+def next_question_index(survey: Dict) -> int:
+    """Returns the next Q<n> DataExportTag number for a survey.
+
+    Tags are never reused: the survey's Next_Question_Index remembers numbers of questions that were removed.
+    """
+    numbers = [int(tag[1:]) for tag in survey.get("Question_Tags", []) if tag.startswith("Q") and tag[1:].isdigit()]
+    return max(survey.get("Next_Question_Index", 1), max(numbers, default=0) + 1)
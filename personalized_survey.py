@@ -5,6 +5,9 @@ from typing import List, Dict
 from langchain_openai import ChatOpenAI # use the package you want
 from langchain.chains import LLMChain
 from langchain.prompts import PromptTemplate
+from response_analysis import option_a_pole
+from incremental import QUESTION_KEYS, diff_activities, drop_activities, merge_surveys, survey_activities
+from prompt_compiler import capped_llm, compile_prompt, strip_question_boilerplate, token_savings
 from pydantic import BaseModel, SecretStr
 import json
 import re
@@ -101,66 +104,76 @@ Given the following activity pair:
 }
 """
 
-# Initialize Prompt Templates
+# Pole of Option A that each pair prompt asks for: the more stressful and the solitary version.
+# option_a_pole() checks it against the labels in the model's output.
+PROMPT_OPTION_A_POLES = {
+    "stress_relax": "stress",
+    "social_solitary": "solitary",
+}
+
+# Initialize Prompt Templates (compiled to drop whitespace that would only cost input tokens)
 extract_activities_template = PromptTemplate(
     input_variables=["responses"],
-    template=extract_activities_prompt
+    template=compile_prompt(extract_activities_prompt)
 )
 
 generate_stress_relax_template = PromptTemplate(
     input_variables=["activity"],
-    template=generate_stress_relax_pairs_prompt
+    template=compile_prompt(generate_stress_relax_pairs_prompt)
 )
 
 generate_social_solitary_template = PromptTemplate(
     input_variables=["activity"],
-    template=generate_social_solitary_pairs_prompt
+    template=compile_prompt(generate_social_solitary_pairs_prompt)
 )
 
 create_survey_question_template = PromptTemplate(
     input_variables=["option_a", "option_b"],
-    template=create_survey_question_prompt
+    template=compile_prompt(create_survey_question_prompt)
 )
 
 convert_pair_to_json_template = PromptTemplate(
     input_variables=["pair_text"],
-    template=convert_pair_to_json_prompt
+    template=compile_prompt(convert_pair_to_json_prompt)
 )
 
-# Initialize Chains
+# Initialize Chains, each capped to the output tokens its task needs
 extract_activities_chain = LLMChain(
-    llm=llm,
+    llm=capped_llm(llm, "activities"),
     prompt=extract_activities_template,
     output_key="activities"
 )
 
 generate_stress_relax_chain = LLMChain(
-    llm=llm,
+    llm=capped_llm(llm, "stress_relax_pair"),
     prompt=generate_stress_relax_template,
     output_key="stress_relax_pair"
 )
 
 generate_social_solitary_chain = LLMChain(
-    llm=llm,
+    llm=capped_llm(llm, "social_solitary_pair"),
     prompt=generate_social_solitary_template,
     output_key="social_solitary_pair"
 )
 
 create_survey_question_chain = LLMChain(
-    llm=llm,
+    llm=capped_llm(llm, "survey_question"),
     prompt=create_survey_question_template,
     output_key="survey_question"
 )
 
 convert_pair_to_json_chain = LLMChain(
-    llm=llm,
+    llm=capped_llm(llm, "json_output"),
     prompt=convert_pair_to_json_template,
     output_key="json_output"
 )
 
 def extract_activities(responses: str) -> List[str]:
     """Extracts a list of unique activities from user responses."""
-    output = extract_activities_chain.invoke({"responses": responses})
+    # Only the answers are sent; the question headers carry no activities
+    compact_responses = strip_question_boilerplate(responses) or responses
+    output = extract_activities_chain.invoke({"responses": compact_responses})
+    token_savings.record(extract_activities_chain, extract_activities_prompt, {"responses": responses}, {"responses": compact_responses})
     activities = output["activities"].split("\n")
     activities = [re.sub(r'^\d+\.\s*', '', line.strip("- ").strip()) for line in activities if line.strip("- ").strip()]
     seen = set()
@@ -198,6 +211,7 @@ def convert_pair_to_json(pair_text: str) -> Dict[str, str]:
     try:
         # Use LLM to convert pair_text to JSON
         output = convert_pair_to_json_chain.invoke({"pair_text": pair_text})
+        token_savings.record(convert_pair_to_json_chain, convert_pair_to_json_prompt, {"pair_text": pair_text})
         print("Debug - LLM output:", output)  # Debug print
 
         output_text = output.get("json_output", "")
@@ -231,84 +245,139 @@ def convert_pair_to_json(pair_text: str) -> Dict[str, str]:
 def generate_stress_relax_pairs(activity: str) -> Dict[str, str]:
     """Generates stressful and relaxing versions of an activity and converts to JSON."""
     output = generate_stress_relax_chain.invoke({"activity": activity})
+    token_savings.record(generate_stress_relax_chain, generate_stress_relax_pairs_prompt, {"activity": activity})
     pair_text = output["stress_relax_pair"]
     # print("Debug - generate_stress_relax_pairs output:", pair_text)  # Debug print
     pair_json = convert_pair_to_json(pair_text)
+    pair_json["Option_A_Pole"] = option_a_pole("stress_relax", pair_text, pair_json.get("Option_A"), PROMPT_OPTION_A_POLES["stress_relax"])
     return pair_json
 
 def generate_social_solitary_pairs(activity: str) -> Dict[str, str]:
     """Generates solitary and social versions of an activity and converts to JSON."""
     output = generate_social_solitary_chain.invoke({"activity": activity})
+    token_savings.record(generate_social_solitary_chain, generate_social_solitary_pairs_prompt, {"activity": activity})
     pair_text = output["social_solitary_pair"]
     # print("Debug - generate_social_solitary_pairs output:", pair_text)  # Debug print
     pair_json = convert_pair_to_json(pair_text)
+    pair_json["Option_A_Pole"] = option_a_pole("social_solitary", pair_text, pair_json.get("Option_A"), PROMPT_OPTION_A_POLES["social_solitary"])
     return pair_json
 
 def create_survey_question(option_a: str, option_b: str) -> str:
     """Creates a survey question given two activity options."""
     output = create_survey_question_chain.invoke({"option_a": option_a, "option_b": option_b})
+    token_savings.record(create_survey_question_chain, create_survey_question_prompt, {"option_a": option_a, "option_b": option_b})
     # Clean the output by removing any leading/trailing whitespace
     question = output["survey_question"].strip()
     return question
 
-def generate_personalized_survey(responses: str, num_questions: int = None) -> Dict[str, List[str]]:
-    """Generates a personalized survey based on user responses."""
-    activities = extract_activities(responses)
-
-    if not activities:
-        print("No activities extracted from the responses.")
-        return {
-            "Stressful_vs_Relaxing_Pairs": [],
-            "Solitary_vs_Social_Pairs": [],
-            "Survey_Questions": []
-        }
-
-    # Determine the number of activities to process based on num_questions
-    # Each activity generates 2 survey questions (Stressful vs Relaxing and Solitary vs Social)
-    if num_questions:
-        max_activities = num_questions // 2
-        activities = activities[:max_activities]
-        print(f"Generating survey for the first {max_activities} activities based on the specified number of questions.")
-    else:
-        print(f"Generating survey for all {len(activities)} extracted activities.")
-
+def generate_activity_questions(activities: List[str]) -> Dict[str, List]:
+    """Generates both activity pairs and their survey questions for each activity."""
     stress_relax_pairs = []
     social_solitary_pairs = []
     survey_questions = []
+    # Pair type, pole of Option A and source activity of each survey question, aligned with survey_questions
+    question_pair_types = []
+    question_option_a_poles = []
+    question_activities = []
 
 
     for activity in activities:
         # Generate Stressful vs Relaxing pairs
         stress_relax = generate_stress_relax_pairs(activity)
         if "Option_A" in stress_relax and "Option_B" in stress_relax:
+            stress_relax["Activity"] = activity
             stress_relax_pairs.append(stress_relax)
             question = create_survey_question(
                 option_a=stress_relax["Option_A"],
                 option_b=stress_relax["Option_B"]
             )
             survey_questions.append(question)
+            question_pair_types.append("stress_relax")
+            question_option_a_poles.append(stress_relax["Option_A_Pole"])
+            question_activities.append(activity)
 
         # Generate Solitary vs Social pairs
         social_solitary = generate_social_solitary_pairs(activity)
         if "Option_A" in social_solitary and "Option_B" in social_solitary:
+            social_solitary["Activity"] = activity
             social_solitary_pairs.append(social_solitary)
             question = create_survey_question(
                 option_a=social_solitary["Option_A"],
                 option_b=social_solitary["Option_B"]
             )
             survey_questions.append(question)
-
-    # If num_questions is specified and there are more survey questions than needed, trim the list
-    if num_questions and len(survey_questions) > num_questions:
-        survey_questions = survey_questions[:num_questions]
-        print(f"Trimmed the survey questions to the specified number of {num_questions}.")
+            question_pair_types.append("social_solitary")
+            question_option_a_poles.append(social_solitary["Option_A_Pole"])
+            question_activities.append(activity)
 
     return {
+        "Activities": activities,
         "Stressful_vs_Relaxing_Pairs": stress_relax_pairs,
         "Solitary_vs_Social_Pairs": social_solitary_pairs,
-        "Survey_Questions": survey_questions
+        "Survey_Questions": survey_questions,
+        "Question_Pair_Types": question_pair_types,
+        "Question_Option_A_Poles": question_option_a_poles,
+        "Question_Activities": question_activities
     }
 
+def trim_survey_questions(survey: Dict[str, List], num_questions: int = None) -> Dict[str, List]:
+    """Trims the survey questions (and the lists aligned with them) to num_questions."""
+    # If num_questions is specified and there are more survey questions than needed, trim the list
+    if num_questions and len(survey["Survey_Questions"]) > num_questions:
+        for key in QUESTION_KEYS:
+            if key in survey:
+                survey[key] = survey[key][:num_questions]
+        print(f"Trimmed the survey questions to the specified number of {num_questions}.")
+    return survey
+
+def generate_personalized_survey(responses: str, num_questions: int = None) -> Dict[str, List[str]]:
+    """Generates a personalized survey based on user responses."""
+    activities = extract_activities(responses)
+
+    if not activities:
+        print("No activities extracted from the responses.")
+        return {
+            "Activities": [],
+            "Stressful_vs_Relaxing_Pairs": [],
+            "Solitary_vs_Social_Pairs": [],
+            "Survey_Questions": [],
+            "Question_Pair_Types": [],
+            "Question_Option_A_Poles": [],
+            "Question_Activities": []
+        }
+
+    # Determine the number of activities to process based on num_questions
+    # Each activity generates 2 survey questions (Stressful vs Relaxing and Solitary vs Social)
+    if num_questions:
+        max_activities = num_questions // 2
+        activities = activities[:max_activities]
+        print(f"Generating survey for the first {max_activities} activities based on the specified number of questions.")
+    else:
+        print(f"Generating survey for all {len(activities)} extracted activities.")
+
+    survey = generate_activity_questions(activities)
+    return trim_survey_questions(survey, num_questions)
+
+def update_personalized_survey(responses: str, previous: Dict[str, List], num_questions: int = None) -> Dict[str, List[str]]:
+    """Updates a previously generated survey after the user's responses changed.
+
+    Pairs and questions are only generated for activities added since the previous run, and those of
+    removed activities are dropped; everything else is reused from previous.
+    """
+    activities = extract_activities(responses)
+    added, removed = diff_activities(survey_activities(previous), activities)
+    print(f"Activities added: {added}, removed: {removed}")
+
+    survey, _ = drop_activities(previous, removed)
+
+    # Keep within the activity budget of a full run
+    if num_questions:
+        added = added[:max(0, num_questions // 2 - len(survey["Activities"]))]
+
+    if added:
+        survey = merge_surveys(survey, generate_activity_questions(added))
+    return trim_survey_questions(survey, num_questions)
+
 
 # Example Usage
 if __name__ == "__main__":
@@ -381,6 +450,7 @@ if __name__ == "__main__":
     for idx, question in enumerate(survey["Survey_Questions"], 1):
         print(f"{idx}. {question}\n")
 
+    token_savings.report()
 
 
 """
@@ -0,0 +1,157 @@
+
+# prompt_compiler.py
+import re
+import textwrap
+from typing import Dict
+from langchain_core.callbacks import BaseCallbackHandler
+
+
+# max_tokens the chains reserved before per-chain caps were introduced
+BASELINE_MAX_TOKENS = 1500
+
+# Output token caps per chain, keyed by the chain's output_key.
+# Sized to the expected output with headroom: a bullet list of activities, or a couple of short lines.
+OUTPUT_TOKEN_CAPS = {
+    "activities": 400,
+    "stress_relax_pair": 100,
+    "social_solitary_pair": 100,
+    "survey_question": 120,
+    "json_output": 100,
+}
+
+# Section labels used in the open-ended questionnaire
+CATEGORY_LABELS = {"anxiety", "relax", "relaxation", "loneliness", "reduce loneliness"}
+
+# A bullet or list number followed by whitespace, so "1.5 hours" and "-ish" inside an answer are left alone
+ANSWER_LINE = re.compile(r"^(•\s*|[-*]\s+|\d+[.)]\s+)")
+
+
+def strip_question_boilerplate(responses: str) -> str:
+    """Keeps the respondent's answers and the section they belong to from a block of questions and answers.
+
+    Only the question sentences are dropped: a question header is a non-bullet line directly followed by
+    bullet answers ("When do you feel anxious? provide 5 situations"), and it is dropped only inside a
+    section whose label ("anxiety", "relax", ...) is kept, so answers stay grouped by what they describe.
+    Bullet answers are normalized to "- answer"; every other line is free text written by the respondent
+    and is kept as it is.
+    """
+    lines = [line.strip() for line in responses.splitlines()]
+    lines = [line for line in lines if line]
+    bullets = [ANSWER_LINE.match(line) for line in lines]
+
+    answers = []
+    in_section = False
+    for idx, line in enumerate(lines):
+        if bullets[idx]:
+            answer = line[bullets[idx].end():].strip()
+            if answer:
+                answers.append(f"- {answer}")
+        elif line.lower() in CATEGORY_LABELS:
+            in_section = True
+            answers.append(line.lower())
+        elif in_section and idx + 1 < len(lines) and bullets[idx + 1]:
+            continue
+        else:
+            answers.append(line)
+    return "\n".join(answers)
+
+
+def compile_prompt(template: str) -> str:
+    """Removes indentation, trailing whitespace and repeated blank lines from a prompt template."""
+    lines = [line.rstrip() for line in textwrap.dedent(template).strip().splitlines()]
+    compiled = []
+    for line in lines:
+        if not line and compiled and not compiled[-1]:
+            continue
+        compiled.append(line)
+    return "\n".join(compiled)
+
+
+def output_token_cap(output_key: str) -> int:
+    return OUTPUT_TOKEN_CAPS.get(output_key, BASELINE_MAX_TOKENS)
+
+
+def capped_llm(llm, output_key: str):
+    """Binds the chain's output token cap to llm and counts the output tokens it actually generates."""
+    return llm.bind(max_tokens=output_token_cap(output_key)).with_config(
+        callbacks=[OutputTokenCounter(token_savings, output_key)]
+    )
+
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("cl100k_base")
+
+    def count_tokens(text: str) -> int:
+        return len(_encoding.encode(text))
+except Exception:
+    def count_tokens(text: str) -> int:
+        # Rough estimate of ~4 characters per token when tiktoken is not available
+        return (len(text) + 3) // 4
+
+
+class TokenSavings:
+    """Accumulates per chain the input tokens removed by prompt compilation, the output tokens actually
+    generated (from the model's usage metadata) and the output capacity no longer reserved by max_tokens.
+
+    Reserved_Output_Tokens_Released is a change in the max_tokens request parameter, not in billed tokens;
+    billed output only drops where the old cap was being reached.
+    """
+
+    def __init__(self, baseline_max_tokens: int = BASELINE_MAX_TOKENS):
+        self.baseline_max_tokens = baseline_max_tokens
+        self.stages: Dict[str, Dict[str, int]] = {}
+
+    def _stage(self, output_key: str) -> Dict[str, int]:
+        return self.stages.setdefault(output_key, {
+            "Calls": 0,
+            "Input_Tokens_Saved": 0,
+            "Output_Tokens": 0,
+            "Output_Token_Cap": output_token_cap(output_key),
+            "Reserved_Output_Tokens_Released": 0
+        })
+
+    def record(self, chain, original_template: str, inputs: Dict[str, str],
+               compiled_inputs: Dict[str, str] = None) -> None:
+        """Records one invocation of chain, comparing the uncompiled prompt and inputs with what was sent."""
+        compiled_inputs = compiled_inputs or inputs
+        original = original_template + "".join(inputs.values())
+        compiled = chain.prompt.template + "".join(compiled_inputs.values())
+        stage = self._stage(chain.output_key)
+        stage["Calls"] += 1
+        stage["Input_Tokens_Saved"] += count_tokens(original) - count_tokens(compiled)
+        stage["Reserved_Output_Tokens_Released"] += self.baseline_max_tokens - output_token_cap(chain.output_key)
+
+    def record_output_tokens(self, output_key: str, tokens: int) -> None:
+        self._stage(output_key)["Output_Tokens"] += tokens
+
+    def report(self) -> Dict[str, Dict[str, int]]:
+        """Prints and returns the token usage and savings per stage."""
+        print("### Token Savings ###")
+        for name, stage in self.stages.items():
+            print(f"{name}: {stage['Calls']} calls, {stage['Input_Tokens_Saved']} input tokens saved, "
+                  f"{stage['Output_Tokens']} output tokens generated (cap {stage['Output_Token_Cap']} per call), "
+                  f"{stage['Reserved_Output_Tokens_Released']} reserved output tokens released")
+        return self.stages
+
+
+class OutputTokenCounter(BaseCallbackHandler):
+    """Adds the output tokens reported by the model for each call to a TokenSavings stage."""
+
+    def __init__(self, savings: TokenSavings, output_key: str):
+        self.savings = savings
+        self.output_key = output_key
+
+    def on_llm_end(self, response, **kwargs) -> None:
+        tokens = 0
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if usage:
+                    tokens += usage.get("output_tokens", 0)
+        if not tokens and response.llm_output:
+            tokens = response.llm_output.get("token_usage", {}).get("completion_tokens", 0)
+        self.savings.record_output_tokens(self.output_key, tokens)
+
+
+token_savings = TokenSavings()
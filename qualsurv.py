@@ -3,68 +3,18 @@ from typing import List, Dict
 from langchain_openai import ChatOpenAI
 from langchain.chains import LLMChain
 from langchain.prompts import PromptTemplate
+from prompt_compiler import capped_llm, compile_prompt, strip_question_boilerplate, token_savings
 import json
 import re
-import requests
 from dotenv import load_dotenv
+from qualtrics_api import QualtricsAPI
+from survey_export import build_question_payload
+from response_analysis import option_a_pole
+from incremental import diff_activities, drop_activities, merge_surveys, next_question_index, survey_activities
 
 # Load environment variables from .env file
 load_dotenv()
 
-class QualtricsAPI:
-    def __init__(self, api_token: str):
-        self.api_token = api_token
-        self.base_url = "https://yul1.qualtrics.com/API/v3"
-        self.headers = {
-            "X-API-TOKEN": api_token,
-            "Content-Type": "application/json"
-        }
-
-    def create_survey(self, name: str) -> dict:
-        url = f"{self.base_url}/survey-definitions"
-        payload = {
-            "SurveyName": name,
-            "Language": "EN",
-            "ProjectCategory": "CORE"
-        }
-        response = requests.post(url, json=payload, headers=self.headers)
-        print(f"Create survey response: {response.status_code}, {response.text}")
-        return response.json()
-
-    def activate_survey(self, survey_id: str) -> bool:
-        """Activate a survey to make it available for responses."""
-        url = f"{self.base_url}/surveys/{survey_id}"
-        payload = {
-            "isActive": True
-        }
-        try:
-            response = requests.put(url, json=payload, headers=self.headers)
-            print(f"Activate survey response: {response.status_code}, {response.text}")
-            return response.status_code == 200
-        except Exception as e:
-            print(f"Error activating survey: {str(e)}")
-            return False
-
-    def add_question(self, survey_id: str, question_payload: dict) -> dict:
-        url = f"{self.base_url}/survey-definitions/{survey_id}/questions"
-        response = requests.post(url, json=question_payload, headers=self.headers)
-        print(f"Add question response: {response.status_code}, {response.text}")
-        return response.json()
-
-    def distribute_survey(self, survey_id: str, distribution_name: str) -> dict:
-        # Generate anonymous link directly
-        base = self.base_url.replace("/API/v3", "")
-        return {
-            "result": {
-                "id": None,
-                "link": f"{base}/jfe/form/{survey_id}"
-            }
-        }
-
-    def get_distribution_link(self, survey_id: str, distribution_id: str = None) -> str:
-        base = self.base_url.replace("/API/v3", "")
-        return f"{base}/jfe/form/{survey_id}"
-
 def validate_environment():
     required_vars = {
         "OPENAI_API_KEY": os.getenv("OPENAI_API_KEY"),
@@ -151,18 +101,26 @@ You are given an activity pair in text format. Extract the two activities and ou
 ### Your JSON Output:
 """
 
+# Pole of Option A that each pair prompt asks for: the relaxing and the solitary activity are listed first.
+# option_a_pole() checks it against the labels in the model's output.
+PROMPT_OPTION_A_POLES = {
+    "stress_relax": "relax",
+    "social_solitary": "solitary",
+}
+
 # Initialize Prompt Templates and Chains
-extract_activities_template = PromptTemplate(input_variables=["responses"], template=extract_activities_prompt)
-generate_stress_relax_template = PromptTemplate(input_variables=["activity"], template=generate_stress_relax_pairs_prompt)
-generate_social_solitary_template = PromptTemplate(input_variables=["activity"], template=generate_social_solitary_pairs_prompt)
-create_survey_question_template = PromptTemplate(input_variables=["option_a", "option_b"], template=create_survey_question_prompt)
-convert_pair_to_json_template = PromptTemplate(input_variables=["pair_text"], template=convert_pair_to_json_prompt)
-
-extract_activities_chain = LLMChain(llm=llm, prompt=extract_activities_template, output_key="activities")
-generate_stress_relax_chain = LLMChain(llm=llm, prompt=generate_stress_relax_template, output_key="stress_relax_pair")
-generate_social_solitary_chain = LLMChain(llm=llm, prompt=generate_social_solitary_template, output_key="social_solitary_pair")
-create_survey_question_chain = LLMChain(llm=llm, prompt=create_survey_question_template, output_key="survey_question")
-convert_pair_to_json_chain = LLMChain(llm=llm, prompt=convert_pair_to_json_template, output_key="json_output")
+# Templates are compiled to drop whitespace that would only cost input tokens, and each chain is capped to the output tokens its task needs
+extract_activities_template = PromptTemplate(input_variables=["responses"], template=compile_prompt(extract_activities_prompt))
+generate_stress_relax_template = PromptTemplate(input_variables=["activity"], template=compile_prompt(generate_stress_relax_pairs_prompt))
+generate_social_solitary_template = PromptTemplate(input_variables=["activity"], template=compile_prompt(generate_social_solitary_pairs_prompt))
+create_survey_question_template = PromptTemplate(input_variables=["option_a", "option_b"], template=compile_prompt(create_survey_question_prompt))
+convert_pair_to_json_template = PromptTemplate(input_variables=["pair_text"], template=compile_prompt(convert_pair_to_json_prompt))
+
+extract_activities_chain = LLMChain(llm=capped_llm(llm, "activities"), prompt=extract_activities_template, output_key="activities")
+generate_stress_relax_chain = LLMChain(llm=capped_llm(llm, "stress_relax_pair"), prompt=generate_stress_relax_template, output_key="stress_relax_pair")
+generate_social_solitary_chain = LLMChain(llm=capped_llm(llm, "social_solitary_pair"), prompt=generate_social_solitary_template, output_key="social_solitary_pair")
+create_survey_question_chain = LLMChain(llm=capped_llm(llm, "survey_question"), prompt=create_survey_question_template, output_key="survey_question")
+convert_pair_to_json_chain = LLMChain(llm=capped_llm(llm, "json_output"), prompt=convert_pair_to_json_template, output_key="json_output")
 
 def ensure_conciseness(activity: str, max_words: int = 5) -> str:
     words = activity.split()
@@ -171,7 +129,10 @@ def ensure_conciseness(activity: str, max_words: int = 5) -> str:
     return activity
 
 def extract_activities(responses: str) -> List[str]:
-    output = extract_activities_chain.invoke({"responses": responses})
+    # Only the answers are sent; the question headers carry no activities
+    compact_responses = strip_question_boilerplate(responses) or responses
+    output = extract_activities_chain.invoke({"responses": compact_responses})
+    token_savings.record(extract_activities_chain, extract_activities_prompt, {"responses": responses}, {"responses": compact_responses})
     activities = output["activities"].split("\n")
     activities = [line.strip("- ").strip() for line in activities if line.strip("- ").strip()]
     seen = set()
@@ -194,6 +155,7 @@ def convert_pair_to_json(pair_text: str) -> Dict[str, str]:
 
     try:
         output = convert_pair_to_json_chain.invoke({"pair_text": pair_text})
+        token_savings.record(convert_pair_to_json_chain, convert_pair_to_json_prompt, {"pair_text": pair_text})
         output_text = output.get("json_output", "")
 
         json_str = re.search(r'\{.*\}', output_text, re.DOTALL)
@@ -227,55 +189,115 @@ def convert_pair_to_json(pair_text: str) -> Dict[str, str]:
 
 def generate_stress_relax_pairs(activity: str) -> Dict[str, str]:
     output = generate_stress_relax_chain.invoke({"activity": activity})
+    token_savings.record(generate_stress_relax_chain, generate_stress_relax_pairs_prompt, {"activity": activity})
     pair_text = output["stress_relax_pair"]
-    return convert_pair_to_json(pair_text)
+    pair = convert_pair_to_json(pair_text)
+    pair["Option_A_Pole"] = option_a_pole("stress_relax", pair_text, pair.get("Option_A"), PROMPT_OPTION_A_POLES["stress_relax"])
+    return pair
 
 def generate_social_solitary_pairs(activity: str) -> Dict[str, str]:
     output = generate_social_solitary_chain.invoke({"activity": activity})
+    token_savings.record(generate_social_solitary_chain, generate_social_solitary_pairs_prompt, {"activity": activity})
     pair_text = output["social_solitary_pair"]
-    return convert_pair_to_json(pair_text)
+    pair = convert_pair_to_json(pair_text)
+    pair["Option_A_Pole"] = option_a_pole("social_solitary", pair_text, pair.get("Option_A"), PROMPT_OPTION_A_POLES["social_solitary"])
+    return pair
 
 def create_survey_question(option_a: str, option_b: str) -> str:
     output = create_survey_question_chain.invoke({"option_a": option_a, "option_b": option_b})
+    token_savings.record(create_survey_question_chain, create_survey_question_prompt, {"option_a": option_a, "option_b": option_b})
     return output["survey_question"].strip()
 
-def generate_personalized_survey(responses: str) -> Dict[str, List[str]]:
+def generate_activity_questions(activities: List[str]) -> Dict[str, List]:
+    """Generates both activity pairs and their survey questions for each activity."""
+    stress_relax_pairs = []
+    social_solitary_pairs = []
+    survey_questions = []
+    # Pair type, pole of Option A and source activity of each survey question, aligned with survey_questions
+    question_pair_types = []
+    question_option_a_poles = []
+    question_activities = []
+
+    for activity in activities:
+        try:
+            # Generate stress/relax pairs
+            stress_relax = generate_stress_relax_pairs(activity)
+            if stress_relax.get("Option_A") and stress_relax.get("Option_B"):
+                stress_relax["Activity"] = activity
+                stress_relax_pairs.append(stress_relax)
+                question = create_survey_question(
+                    option_a=stress_relax["Option_A"],
+                    option_b=stress_relax["Option_B"]
+                )
+                survey_questions.append(question)
+                question_pair_types.append("stress_relax")
+                question_option_a_poles.append(stress_relax["Option_A_Pole"])
+                question_activities.append(activity)
+
+            # Generate social/solitary pairs
+            social_solitary = generate_social_solitary_pairs(activity)
+            if social_solitary.get("Option_A") and social_solitary.get("Option_B"):
+                social_solitary["Activity"] = activity
+                social_solitary_pairs.append(social_solitary)
+                question = create_survey_question(
+                    option_a=social_solitary["Option_A"],
+                    option_b=social_solitary["Option_B"]
+                )
+                survey_questions.append(question)
+                question_pair_types.append("social_solitary")
+                question_option_a_poles.append(social_solitary["Option_A_Pole"])
+                question_activities.append(activity)
+        except Exception as e:
+            print(f"Error processing activity {activity}: {str(e)}")
+            continue
+
+    return {
+        "Activities": activities,
+        "Stressful_vs_Relaxing_Pairs": stress_relax_pairs,
+        "Solitary_vs_Social_Pairs": social_solitary_pairs,
+        "Survey_Questions": survey_questions,
+        "Question_Pair_Types": question_pair_types,
+        "Question_Option_A_Poles": question_option_a_poles,
+        "Question_Activities": question_activities
+    }
+
+def add_survey_questions(survey_id: str, survey_questions: List[str], start_idx: int = 1) -> Dict[str, List]:
+    """Adds questions to a Qualtrics survey, tagged Q<start_idx>, Q<start_idx + 1>, ...
+
+    Returns the DataExportTag and QuestionID of every question (QuestionID is None if adding failed).
+    """
+    question_tags = []
+    question_ids = []
+    for idx, question_text in enumerate(survey_questions, start_idx):
+        question_id = None
+        try:
+            question_payload = build_question_payload(question_text, idx)
+            question_response = qualtrics.add_question(survey_id, question_payload)
+            print(f"Question added: {question_response}")
+            question_id = question_response.get("result", {}).get("QuestionID")
+            if not question_id:
+                print(f"Warning: Question may not have been added properly: {question_text}")
+        except Exception as e:
+            print(f"Error adding question: {str(e)}")
+        question_tags.append(f"Q{idx}")
+        question_ids.append(question_id)
+    return {"Question_Tags": question_tags, "Question_IDs": question_ids}
+
+def generate_personalized_survey(responses: str, export_sink=None) -> Dict[str, List[str]]:
+    """Generates a personalized survey and creates it in Qualtrics.
+
+    If export_sink (a survey_export.QSFExportSink) is given, the survey is written to a QSF file for a later
+    bulk import instead, and no Qualtrics request is made.
+    """
     try:
         # Extract activities
         activities = extract_activities(responses)
         if not activities:
             raise ValueError("No activities extracted from responses")
 
-        # Initialize lists for storing pairs and questions
-        stress_relax_pairs = []
-        social_solitary_pairs = []
-        survey_questions = []
-
-        # Generate questions for each activity
-        for activity in activities:
-            try:
-                # Generate stress/relax pairs
-                stress_relax = generate_stress_relax_pairs(activity)
-                if stress_relax.get("Option_A") and stress_relax.get("Option_B"):
-                    stress_relax_pairs.append(stress_relax)
-                    question = create_survey_question(
-                        option_a=stress_relax["Option_A"],
-                        option_b=stress_relax["Option_B"]
-                    )
-                    survey_questions.append(question)
-
-                # Generate social/solitary pairs
-                social_solitary = generate_social_solitary_pairs(activity)
-                if social_solitary.get("Option_A") and social_solitary.get("Option_B"):
-                    social_solitary_pairs.append(social_solitary)
-                    question = create_survey_question(
-                        option_a=social_solitary["Option_A"],
-                        option_b=social_solitary["Option_B"]
-                    )
-                    survey_questions.append(question)
-            except Exception as e:
-                print(f"Error processing activity {activity}: {str(e)}")
-                continue
+        # Generate pairs and questions for each activity
+        survey = generate_activity_questions(activities)
+        survey_questions = survey["Survey_Questions"]
 
         if not survey_questions:
             raise ValueError("No valid survey questions generated")
@@ -283,6 +305,12 @@ def generate_personalized_survey(responses: str) -> Dict[str, List[str]]:
         # Create survey
         survey_name = "Personalized Activity Preference Survey"
 
+        if export_sink is not None:
+            survey["Question_Tags"] = [f"Q{idx}" for idx in range(1, len(survey_questions) + 1)]
+            survey["Survey_File"] = export_sink.write_survey(survey_name, survey)
+            print(f"Survey written to {survey['Survey_File']}")
+            return survey
+
         try:
             survey_response = qualtrics.create_survey(survey_name)
             print(f"Survey creation response: {survey_response}")
@@ -300,9 +328,7 @@ def generate_personalized_survey(responses: str) -> Dict[str, List[str]]:
             survey_id = result["SurveyID"]
 
             # Retrieve default block ID
-            survey_details_url = f"{qualtrics.base_url}/survey-definitions/{survey_id}"
-            response = requests.get(survey_details_url, headers=qualtrics.headers)
-            survey_details = response.json()
+            survey_details = qualtrics.get_survey_definition(survey_id)
             if "result" in survey_details and "Blocks" in survey_details["result"]:
                 blocks = survey_details["result"]["Blocks"]
                 default_block_id = list(blocks.keys())[0]
@@ -314,35 +340,7 @@ def generate_personalized_survey(responses: str) -> Dict[str, List[str]]:
             raise
 
         # Add questions to survey
-        for idx, question_text in enumerate(survey_questions, 1):
-            try:
-                question_payload = {
-                    "QuestionText": question_text,
-                    "DataExportTag": f"Q{idx}",
-                    "QuestionType": "MC",
-                    "Selector": "SAVR",
-                    "SubSelector": "TX",
-                    "Configuration": {
-                        "QuestionDescriptionOption": "UseText"
-                    },
-                    "Choices": {
-                        "1": {"Display": "Option A"},
-                        "2": {"Display": "Option B"}
-                    },
-                    "Validation": {
-                        "Settings": {
-                            "ForceResponse": "OFF",
-                            "Type": "None"
-                        }
-                    }
-                }
-                question_response = qualtrics.add_question(survey_id, question_payload)
-                print(f"Question added: {question_response}")
-                if not question_response.get("result", {}).get("QuestionID"):
-                    print(f"Warning: Question may not have been added properly: {question_text}")
-            except Exception as e:
-                print(f"Error adding question: {str(e)}")
-                continue
+        survey.update(add_survey_questions(survey_id, survey_questions))
 
         # Activate the survey
         activation_success = qualtrics.activate_survey(survey_id)
@@ -363,18 +361,125 @@ def generate_personalized_survey(responses: str) -> Dict[str, List[str]]:
         if not survey_link:
             raise ValueError("Failed to generate survey link")
         
-        return {
-            "Stressful_vs_Relaxing_Pairs": stress_relax_pairs,
-            "Solitary_vs_Social_Pairs": social_solitary_pairs,
-            "Survey_Questions": survey_questions,
-            "Survey_Link": survey_link,
-            "Survey_ID": survey_id
-        }
+        survey["Survey_Link"] = survey_link
+        survey["Survey_ID"] = survey_id
+        return survey
 
     except Exception as e:
         print(f"Error generating survey: {str(e)}")
         raise
 
+def resolve_question_ids(survey_id: str, survey: Dict) -> List[str]:
+    """Returns the QuestionID of every question in survey (Question_IDs and Question_Tags must be aligned).
+
+    QuestionIDs that were not recorded (surveys from the QSF export sink, or generated before they were
+    tracked) are looked up by DataExportTag in the survey definition; unresolved ones are None.
+    """
+    question_ids = survey["Question_IDs"]
+    if all(question_ids):
+        return question_ids
+
+    survey_details = qualtrics.get_survey_definition(survey_id)
+    questions = survey_details.get("result", {}).get("Questions", {})
+    ids_by_tag = {question.get("DataExportTag"): question_id for question_id, question in questions.items()}
+    return [
+        question_id or ids_by_tag.get(tag)
+        for question_id, tag in zip(question_ids, survey["Question_Tags"])
+    ]
+
+def delete_survey_questions(survey_id: str, questions: List[Dict[str, str]]) -> List[Dict[str, str]]:
+    """Deletes questions given as dicts with Question_ID (may be None), Question_Tag and Question.
+
+    Returns the questions that could not be deleted, so they can be retried later.
+    """
+    question_ids = resolve_question_ids(survey_id, {
+        "Question_IDs": [question["Question_ID"] for question in questions],
+        "Question_Tags": [question["Question_Tag"] for question in questions]
+    }) if questions else []
+
+    pending = []
+    for question, question_id in zip(questions, question_ids):
+        if not question_id:
+            print(f"Warning: No QuestionID found for {question['Question_Tag']}, question was not deleted: "
+                  f"{question['Question']}")
+            pending.append(question)
+        elif not qualtrics.delete_question(survey_id, question_id):
+            print(f"Warning: Question {question_id} was not deleted, retrying on the next update")
+            pending.append(dict(question, Question_ID=question_id))
+    return pending
+
+def update_personalized_survey(responses: str, previous: Dict) -> Dict[str, List[str]]:
+    """Updates a survey created by generate_personalized_survey after the respondent's answers changed.
+
+    Only activities that were added since the previous run get new pairs and questions; questions of
+    removed activities are deleted. The existing Qualtrics survey is patched in place and republished,
+    so its Survey_ID and Survey_Link stay the same.
+
+    The returned survey always reflects the patched Qualtrics survey. Questions that could not be deleted
+    are kept in Pending_Deletes and retried by the next update. If publishing the new version fails, it is
+    returned with Published set to False; call qualtrics.publish_survey again rather than rerunning the update.
+    """
+    try:
+        survey_id = previous.get("Survey_ID")
+        if not survey_id:
+            raise ValueError("Previous survey has no Survey_ID to update")
+
+        activities = extract_activities(responses)
+        if not activities:
+            raise ValueError("No activities extracted from responses")
+
+        added, removed = diff_activities(survey_activities(previous), activities)
+        print(f"Activities added: {added}, removed: {removed}")
+        pending_deletes = list(previous.get("Pending_Deletes", []))
+        if not added and not removed and not pending_deletes:
+            return previous
+
+        # Results without tags were created with contiguous tags Q1, Q2, ...
+        previous = dict(previous)
+        previous["Activities"] = survey_activities(previous)
+        num_previous = len(previous["Survey_Questions"])
+        previous.setdefault("Question_Tags", [f"Q{idx}" for idx in range(1, num_previous + 1)])
+        # Surveys from the QSF export sink have no recorded QuestionIDs
+        previous_ids = list(previous.get("Question_IDs", []))
+        previous["Question_IDs"] = previous_ids + [None] * (num_previous - len(previous_ids))
+        next_idx = next_question_index(previous)
+
+        # Generate everything before touching Qualtrics, so a failure leaves the live survey unchanged
+        survey, dropped = drop_activities(previous, removed)
+        addition = generate_activity_questions(added) if added else None
+        if not survey["Survey_Questions"] and not (addition and addition["Survey_Questions"]):
+            raise ValueError("No valid survey questions left after update")
+
+        # Delete the questions of removed activities, and retry deletes that failed in an earlier update.
+        # Questions that are still live in Qualtrics stay tracked in Pending_Deletes.
+        deletes = pending_deletes + [{
+            "Question_ID": previous["Question_IDs"][idx],
+            "Question_Tag": previous["Question_Tags"][idx],
+            "Question": previous["Survey_Questions"][idx]
+        } for idx in dropped]
+        survey["Pending_Deletes"] = delete_survey_questions(survey_id, deletes)
+        if not added and not removed and len(survey["Pending_Deletes"]) == len(pending_deletes):
+            # Nothing changed in Qualtrics, so there is no new version to publish
+            return survey
+
+        # Add questions for added activities only
+        if addition:
+            addition.update(add_survey_questions(survey_id, addition["Survey_Questions"], start_idx=next_idx))
+            next_idx += len(addition["Survey_Questions"])
+            survey = merge_surveys(survey, addition)
+        survey["Next_Question_Index"] = next_idx
+
+        survey["Published"] = qualtrics.publish_survey(survey_id, f"Updated activities: +{len(added)} / -{len(removed)}")
+        if survey["Published"]:
+            print(f"Survey {survey_id} updated in place.")
+        else:
+            print(f"Warning: Survey {survey_id} was patched but publishing the new version failed.")
+        return survey
+
+    except Exception as e:
+        print(f"Error updating survey: {str(e)}")
+        raise
+
 if __name__ == "__main__":
     # Example usage
     example_responses = """
@@ -395,5 +500,6 @@ if __name__ == "__main__":
         for idx, question in enumerate(survey["Survey_Questions"], 1):
             print(f"{idx}. {question}\n")
         print(f"Survey Link: {survey['Survey_Link']}\n")
+        token_savings.report()
     except Exception as e:
         print(f"Failed to generate survey: {str(e)}")
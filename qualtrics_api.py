@@ -0,0 +1,144 @@
+# qualtrics_api.py
+import os
+import time
+import requests
+
+
+class QualtricsAPI:
+    def __init__(self, api_token: str):
+        self.api_token = api_token
+        self.base_url = "https://yul1.qualtrics.com/API/v3"
+        self.headers = {
+            "X-API-TOKEN": api_token,
+            "Content-Type": "application/json"
+        }
+
+    def create_survey(self, name: str) -> dict:
+        url = f"{self.base_url}/survey-definitions"
+        payload = {
+            "SurveyName": name,
+            "Language": "EN",
+            "ProjectCategory": "CORE"
+        }
+        response = requests.post(url, json=payload, headers=self.headers)
+        print(f"Create survey response: {response.status_code}, {response.text}")
+        return response.json()
+
+    def import_survey(self, name: str, qsf_path: str) -> dict:
+        """Create a survey from a QSF file."""
+        url = f"{self.base_url}/surveys"
+        # Let requests set the multipart Content-Type
+        headers = {"X-API-TOKEN": self.api_token}
+        with open(qsf_path, "rb") as f:
+            files = {"file": (os.path.basename(qsf_path), f, "application/vnd.qualtrics.survey.qsf")}
+            response = requests.post(url, data={"name": name}, files=files, headers=headers)
+        print(f"Import survey response: {response.status_code}, {response.text}")
+        return response.json()
+
+    def activate_survey(self, survey_id: str) -> bool:
+        """Activate a survey to make it available for responses."""
+        url = f"{self.base_url}/surveys/{survey_id}"
+        payload = {
+            "isActive": True
+        }
+        try:
+            response = requests.put(url, json=payload, headers=self.headers)
+            print(f"Activate survey response: {response.status_code}, {response.text}")
+            return response.status_code == 200
+        except Exception as e:
+            print(f"Error activating survey: {str(e)}")
+            return False
+
+    def add_question(self, survey_id: str, question_payload: dict) -> dict:
+        url = f"{self.base_url}/survey-definitions/{survey_id}/questions"
+        response = requests.post(url, json=question_payload, headers=self.headers)
+        print(f"Add question response: {response.status_code}, {response.text}")
+        return response.json()
+
+    def get_survey_definition(self, survey_id: str) -> dict:
+        url = f"{self.base_url}/survey-definitions/{survey_id}"
+        response = requests.get(url, headers=self.headers)
+        return response.json()
+
+    def delete_question(self, survey_id: str, question_id: str) -> bool:
+        url = f"{self.base_url}/survey-definitions/{survey_id}/questions/{question_id}"
+        try:
+            response = requests.delete(url, headers=self.headers)
+            print(f"Delete question response: {response.status_code}, {response.text}")
+            return response.status_code == 200
+        except Exception as e:
+            print(f"Error deleting question: {str(e)}")
+            return False
+
+    def publish_survey(self, survey_id: str, description: str) -> bool:
+        """Publish the current definition so edits reach an already active survey."""
+        url = f"{self.base_url}/survey-definitions/{survey_id}/versions"
+        payload = {
+            "Description": description,
+            "Published": True
+        }
+        try:
+            response = requests.post(url, json=payload, headers=self.headers)
+            print(f"Publish survey response: {response.status_code}, {response.text}")
+            return response.status_code == 200
+        except Exception as e:
+            print(f"Error publishing survey: {str(e)}")
+            return False
+
+    def distribute_survey(self, survey_id: str, distribution_name: str) -> dict:
+        # Generate anonymous link directly
+        base = self.base_url.replace("/API/v3", "")
+        return {
+            "result": {
+                "id": None,
+                "link": f"{base}/jfe/form/{survey_id}"
+            }
+        }
+
+    def get_distribution_link(self, survey_id: str, distribution_id: str = None) -> str:
+        base = self.base_url.replace("/API/v3", "")
+        return f"{base}/jfe/form/{survey_id}"
+
+    def start_response_export(self, survey_id: str, file_format: str = "csv") -> dict:
+        """Start an asynchronous export of all responses to a survey."""
+        url = f"{self.base_url}/surveys/{survey_id}/export-responses"
+        payload = {
+            "format": file_format,
+            "useLabels": False
+        }
+        response = requests.post(url, json=payload, headers=self.headers)
+        print(f"Start response export response: {response.status_code}, {response.text}")
+        return response.json()
+
+    def get_response_export_progress(self, survey_id: str, progress_id: str) -> dict:
+        url = f"{self.base_url}/surveys/{survey_id}/export-responses/{progress_id}"
+        response = requests.get(url, headers=self.headers)
+        return response.json()
+
+    def download_response_export(self, survey_id: str, file_id: str) -> bytes:
+        """Download a finished response export. Qualtrics returns it as a zip archive."""
+        url = f"{self.base_url}/surveys/{survey_id}/export-responses/{file_id}/file"
+        response = requests.get(url, headers=self.headers)
+        print(f"Download response export response: {response.status_code}")
+        response.raise_for_status()
+        return response.content
+
+    def export_responses(self, survey_id: str, file_format: str = "csv",
+                         poll_interval: float = 2.0, timeout: float = 300.0) -> bytes:
+        """Export the responses to a survey and return the zipped export file."""
+        export_response = self.start_response_export(survey_id, file_format)
+        progress_id = export_response.get("result", {}).get("progressId")
+        if not progress_id:
+            raise ValueError(f"Failed to start response export for survey {survey_id}")
+
+        deadline = time.monotonic() + timeout
+        while True:
+            progress = self.get_response_export_progress(survey_id, progress_id).get("result", {})
+            status = progress.get("status")
+            if status == "complete":
+                return self.download_response_export(survey_id, progress["fileId"])
+            if status == "failed":
+                raise ValueError(f"Response export failed for survey {survey_id}")
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Response export for survey {survey_id} did not finish in {timeout}s")
+            time.sleep(poll_interval)
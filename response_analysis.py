@@ -0,0 +1,258 @@
+
+# response_analysis.py
+import io
+import csv
+import re
+import zipfile
+import warnings
+from contextlib import contextmanager
+from typing import List, Dict, Union, Tuple
+import numpy as np
+
+
+# Choice codes of the MC question payload built in qualsurv.py ("1" = Option A, "2" = Option B)
+NO_ANSWER = 0
+OPTION_A = 1
+OPTION_B = 2
+CHOICE_CODES = {
+    "1": OPTION_A,
+    "2": OPTION_B,
+    "Option A": OPTION_A,
+    "Option B": OPTION_B,
+}
+
+# The two poles of each pair type
+PAIR_POLES = {
+    "stress_relax": ("stress", "relax"),
+    "social_solitary": ("solitary", "social"),
+}
+
+# Fallback for results without Question_Option_A_Poles: the pole the qualsurv.py prompts put in Option A
+OPTION_A_POLE = {
+    "stress_relax": "relax",
+    "social_solitary": "solitary",
+}
+
+# Scores are reported so that +1 means always choosing the positive pole and -1 never choosing it
+POSITIVE_POLE = {
+    "stress_relax": "relax",
+    "social_solitary": "social",
+}
+
+# Result keys are "<name>_Scores" and "<name>_Answered" per pair type
+SCORE_NAMES = {
+    "stress_relax": "Relax",
+    "social_solitary": "Social",
+}
+
+QUESTION_TAG = re.compile(r"^Q\d+$")
+
+
+# Rows parsed per np.loadtxt call, which bounds the memory used for raw string values
+CHUNK_ROWS = 100000
+# Raw values are parsed into fixed-width strings: wide enough for every CHOICE_CODES key plus one character,
+# so longer values never match a key. Qualtrics response ids are 17 characters long.
+_RAW_VALUE_WIDTH = max(len(value) for value in CHOICE_CODES) + 1
+_RESPONSE_ID_WIDTH = 64
+
+
+class _LineRecorder:
+    """Iterates over a text stream while remembering how many lines were consumed."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.count = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> str:
+        line = next(self.stream)
+        self.count += 1
+        return line
+
+
+@contextmanager
+def _open_export(source: Union[str, bytes]):
+    """Opens the CSV of a response export as a text stream without reading it into memory."""
+    if isinstance(source, bytes) or source.lower().endswith(".zip"):
+        with zipfile.ZipFile(io.BytesIO(source) if isinstance(source, bytes) else source) as archive:
+            names = [name for name in archive.namelist() if name.lower().endswith(".csv")]
+            if not names:
+                raise ValueError("Response export archive contains no CSV file")
+            with archive.open(names[0]) as raw:
+                yield io.TextIOWrapper(raw, encoding="utf-8-sig", newline="")
+    else:
+        with open(source, "r", encoding="utf-8-sig", newline="") as f:
+            yield f
+
+
+def _read_header(stream) -> Tuple[List[str], int]:
+    """Returns the column names and the number of lines taken by the header records.
+
+    Newer exports follow the column names with a question text row and an ImportId row.
+    """
+    recorder = _LineRecorder(stream)
+    reader = csv.reader(recorder)
+    header = next(reader, [])
+    header_lines = recorder.count
+    if "ResponseId" not in header:
+        raise ValueError("Response export has no ResponseId column")
+    id_col = header.index("ResponseId")
+    for _ in range(2):
+        row = next(reader, None)
+        if row is None or len(row) <= id_col:
+            break
+        if row[id_col] != "Response ID" and not row[id_col].startswith("{"):
+            break
+        header_lines = recorder.count
+    return header, header_lines
+
+
+def read_response_export(source: Union[str, bytes]) -> Tuple[np.ndarray, List[str], np.ndarray]:
+    """Reads a Qualtrics CSV response export.
+
+    source can be a path to a .csv or .zip export, or the zipped bytes returned by QualtricsAPI.export_responses.
+    Returns the response ids, the question tags (Q1, Q2, ...) and a (responses x questions) int8 matrix of
+    choice codes (NO_ANSWER, OPTION_A or OPTION_B).
+
+    The export is streamed in chunks of CHUNK_ROWS rows; only the ResponseId and question columns are parsed
+    and each chunk is converted to int8 codes right away.
+    """
+    with _open_export(source) as stream:
+        header, header_lines = _read_header(stream)
+    id_col = header.index("ResponseId")
+    question_cols = [i for i, name in enumerate(header) if QUESTION_TAG.match(name)]
+    tags = [header[i] for i in question_cols]
+
+    row_dtype = np.dtype([
+        ("id", f"U{_RESPONSE_ID_WIDTH}"),
+        ("choices", f"U{_RAW_VALUE_WIDTH}", (len(question_cols),)),
+    ])
+
+    response_ids = []
+    choices = []
+    with _open_export(source) as stream:
+        for _ in range(header_lines):
+            next(stream)
+        while True:
+            with warnings.catch_warnings():
+                # loadtxt warns when it reaches the end of the stream
+                warnings.simplefilter("ignore", UserWarning)
+                chunk = np.loadtxt(stream, delimiter=",", quotechar='"', comments=None, dtype=row_dtype,
+                                   usecols=[id_col] + question_cols, max_rows=CHUNK_ROWS, ndmin=1)
+            if not len(chunk):
+                break
+            raw = chunk["choices"].reshape(len(chunk), len(question_cols))
+            codes = np.zeros(raw.shape, dtype=np.int8)
+            for value, code in CHOICE_CODES.items():
+                codes[raw == value] = code
+            ids = chunk["id"]
+            response_ids.append(ids.astype(f"U{max(1, int(np.char.str_len(ids).max()))}"))
+            choices.append(codes)
+
+    if not choices:
+        return np.zeros(0, dtype=str), tags, np.zeros((0, len(question_cols)), dtype=np.int8)
+    return np.concatenate(response_ids), tags, np.concatenate(choices)
+
+
+def option_a_pole(pair_type: str, pair_text: str, option_a: str, default: str) -> str:
+    """Returns the pole Option A of a generated pair stands for.
+
+    The pole is read from the label of the pair text line holding Option A ("- Relaxing Activity: Reading"),
+    so it follows the model's output rather than the order the prompt asked for; default is returned when
+    the line has no pole label.
+    """
+    for line in pair_text.splitlines():
+        label, sep, value = line.partition(":")
+        if sep and option_a and option_a.lower() in value.lower():
+            poles = [pole for pole in PAIR_POLES[pair_type] if pole in label.lower()]
+            if len(poles) == 1:
+                return poles[0]
+    return default
+
+
+def question_pair_types(pair_types: Union[List[str], Dict[str, str]]) -> Dict[str, str]:
+    """Maps question tags to pair types.
+
+    Accepts the Question_Pair_Types list of a generated survey (question n has tag Q{n}) or a ready tag mapping.
+    """
+    if isinstance(pair_types, dict):
+        return pair_types
+    return {f"Q{idx}": pair_type for idx, pair_type in enumerate(pair_types, 1)}
+
+
+def preference_scores(choices: np.ndarray, tags: List[str], pair_types: Union[List[str], Dict[str, str]],
+                      option_a_poles: Union[List[str], Dict[str, str]] = None) -> Dict[str, np.ndarray]:
+    """Computes per-respondent preference scores from a matrix of choice codes.
+
+    Each score is (positive choices - negative choices) / answered questions of that pair type, so it lies
+    in [-1, 1]. Respondents who answered no question of a pair type get NaN.
+
+    option_a_poles gives the pole of Option A per question, like pair_types (the Question_Option_A_Poles
+    list of a generated survey or a tag mapping). Questions without one fall back to OPTION_A_POLE.
+    """
+    tag_types = question_pair_types(pair_types)
+    tag_poles = question_pair_types(option_a_poles or {})
+    # +1 where choosing Option A means choosing the positive pole, -1 where it means the opposite
+    option_a_sign = np.array([
+        1 if (tag_poles.get(tag) or OPTION_A_POLE.get(tag_types.get(tag))) == POSITIVE_POLE.get(tag_types.get(tag))
+        else -1
+        for tag in tags
+    ], dtype=np.int8)
+    signs = np.where(choices == OPTION_A, option_a_sign, np.where(choices == OPTION_B, -option_a_sign, 0))
+    answered = choices != NO_ANSWER
+
+    scores = {}
+    for pair_type, name in SCORE_NAMES.items():
+        columns = np.array([tag_types.get(tag) == pair_type for tag in tags], dtype=bool)
+        totals = signs[:, columns].sum(axis=1, dtype=np.int64)
+        counts = answered[:, columns].sum(axis=1, dtype=np.int64)
+        scores[f"{name}_Scores"] = np.where(counts > 0, totals / np.maximum(counts, 1), np.nan)
+        scores[f"{name}_Answered"] = counts
+    return scores
+
+
+def analyze_export(source: Union[str, bytes], pair_types: Union[List[str], Dict[str, str]],
+                   option_a_poles: Union[List[str], Dict[str, str]] = None) -> Dict[str, np.ndarray]:
+    """Reads a response export and scores every response in it."""
+    response_ids, tags, choices = read_response_export(source)
+    result = {"Response_IDs": response_ids}
+    result.update(preference_scores(choices, tags, pair_types, option_a_poles))
+    return result
+
+
+def analyze_survey(survey: Dict, qualtrics=None, export_path: str = None) -> Dict[str, np.ndarray]:
+    """Scores the responses to a survey created by generate_personalized_survey.
+
+    Responses are read from export_path if given, otherwise pulled through the QualtricsAPI client.
+    """
+    if export_path:
+        source = export_path
+    elif qualtrics is not None:
+        source = qualtrics.export_responses(survey["Survey_ID"])
+    else:
+        raise ValueError("Either export_path or a QualtricsAPI client is required")
+    pair_types = survey["Question_Pair_Types"]
+    # Results from before poles were recorded fall back to OPTION_A_POLE
+    option_a_poles = survey.get("Question_Option_A_Poles")
+    if "Question_Tags" in survey:
+        # Tags are not contiguous once a survey has been updated incrementally
+        pair_types = dict(zip(survey["Question_Tags"], pair_types))
+        option_a_poles = dict(zip(survey["Question_Tags"], option_a_poles or []))
+    return analyze_export(source, pair_types, option_a_poles)
+
+
+def cohort_summary(results: List[Dict[str, np.ndarray]]) -> Dict[str, float]:
+    """Aggregates per-respondent scores from several analyzed surveys into cohort-level scores.
+
+    Mean_* averages respondents equally, Pooled_* weights every answered question equally.
+    """
+    summary = {"Respondents": int(sum(len(r["Response_IDs"]) for r in results))}
+    for name in SCORE_NAMES.values():
+        scores = np.concatenate([r[f"{name}_Scores"] for r in results]) if results else np.zeros(0)
+        counts = np.concatenate([r[f"{name}_Answered"] for r in results]) if results else np.zeros(0, dtype=np.int64)
+        answered = int(counts.sum())
+        summary[f"Mean_{name}"] = float(np.nanmean(scores)) if np.any(counts > 0) else float("nan")
+        summary[f"Pooled_{name}"] = float(np.nansum(scores * counts) / answered) if answered else float("nan")
+    return summary
@@ -0,0 +1,334 @@
+
+# result_store.py
+import os
+import hashlib
+from typing import List, Dict, Iterable, Tuple, Optional
+import numpy as np
+
+
+# Pair types are stored as small integer codes
+PAIR_TYPES = ["stress_relax", "social_solitary"]
+PAIR_TYPE_CODES = {name: code for code, name in enumerate(PAIR_TYPES)}
+
+# Keys of the survey dicts returned by generate_personalized_survey, per pair type
+PAIR_LIST_KEYS = {
+    "stress_relax": "Stressful_vs_Relaxing_Pairs",
+    "social_solitary": "Solitary_vs_Social_Pairs",
+}
+
+# Records only hold integer ids: into the interned strings (respondent, activity, variant) and,
+# for questions, into the question text table.
+PAIR_DTYPE = np.dtype([
+    ("respondent", "<i4"),
+    ("activity", "<i4"),
+    ("pair_type", "u1"),
+    ("option_a", "<i4"),
+    ("option_b", "<i4"),
+])
+
+QUESTION_DTYPE = np.dtype([
+    ("respondent", "<i4"),
+    ("activity", "<i4"),
+    ("pair_type", "u1"),
+    ("position", "<i2"),
+    ("question", "<i4"),
+])
+
+# Id used for a missing string (e.g. a pair without a recorded activity)
+MISSING = -1
+
+
+def _string_hashes(encoded: List[bytes]) -> np.ndarray:
+    return np.array([int.from_bytes(hashlib.blake2b(value, digest_size=8).digest(), "little") for value in encoded],
+                    dtype="<u8")
+
+
+class StringTable:
+    """Append-only table of strings, addressed by integer id and read lazily through np.memmap.
+
+    <name>.bin holds the UTF-8 bytes of all strings back to back and <name>.offsets.bin the int64 end offset
+    of each string, so a string is read without loading the others. With hashed=True, <name>.hashes.bin
+    keeps a 64-bit hash per string so find() can locate a string without a dictionary in memory.
+
+    The offsets file is written last, so its length is the number of strings readers can see.
+    """
+
+    def __init__(self, path: str, name: str, hashed: bool = False):
+        self.data_path = os.path.join(path, f"{name}.bin")
+        self.offsets_path = os.path.join(path, f"{name}.offsets.bin")
+        self.hashes_path = os.path.join(path, f"{name}.hashes.bin") if hashed else None
+        self._offsets = np.zeros(0, dtype="<i8")
+        self._data = np.zeros(0, dtype=np.uint8)
+        self._hashes = np.zeros(0, dtype="<u8")
+
+    def __len__(self) -> int:
+        return os.path.getsize(self.offsets_path) // 8 if os.path.exists(self.offsets_path) else 0
+
+    @staticmethod
+    def _map(path: str, dtype, count: int) -> np.ndarray:
+        if count == 0:
+            return np.zeros(0, dtype=dtype)
+        # A plain ndarray view of the mapping; indexing np.memmap itself is much slower per element
+        return np.asarray(np.memmap(path, dtype=dtype, mode="r", shape=(count,)))
+
+    def _refresh(self) -> None:
+        """Re-maps the files, picking up strings appended since they were last mapped (also by other writers)."""
+        count = len(self)
+        if count == len(self._offsets):
+            return
+        self._offsets = self._map(self.offsets_path, "<i8", count)
+        self._data = self._map(self.data_path, np.uint8, int(self._offsets[-1]))
+        if self.hashes_path:
+            self._hashes = self._map(self.hashes_path, "<u8", count)
+
+    def get(self, string_id: int) -> str:
+        if string_id >= len(self._offsets):
+            self._refresh()
+        return self._data[self._span(string_id)].tobytes().decode("utf-8")
+
+    def find(self, value: str) -> int:
+        """Returns the id of value, or MISSING. Requires hashed=True."""
+        self._refresh()
+        for candidate in np.flatnonzero(self._hashes == _string_hashes([value.encode("utf-8")])[0]):
+            if self.get(int(candidate)) == value:
+                return int(candidate)
+        return MISSING
+
+    def find_many(self, encoded: List[bytes], hashes: np.ndarray) -> np.ndarray:
+        """Returns the ids of many UTF-8 encoded strings with the given hashes (MISSING for unknown ones).
+
+        The hashes are matched with one sort and a binary search and the matches are confirmed by comparing
+        the stored bytes in one vectorized pass, so the cost does not grow with decoding the whole table.
+        Requires hashed=True.
+        """
+        self._refresh()
+        ids = np.full(len(encoded), MISSING, dtype=np.int64)
+        if not encoded or not len(self._hashes):
+            return ids
+        order = np.argsort(self._hashes, kind="stable")
+        sorted_hashes = self._hashes[order]
+        positions = np.minimum(np.searchsorted(sorted_hashes, hashes), len(order) - 1)
+        candidates = order[positions]
+        hit = sorted_hashes[positions] == hashes
+        equal = hit & self._equal(candidates, encoded)
+        ids[equal] = candidates[equal]
+
+        # Rare case: a different string with the same hash comes first in the sorted hashes
+        for idx in np.flatnonzero(hit & ~equal):
+            position = positions[idx] + 1
+            while position < len(order) and sorted_hashes[position] == hashes[idx]:
+                if self._data[self._span(order[position])].tobytes() == encoded[idx]:
+                    ids[idx] = order[position]
+                    break
+                position += 1
+        return ids
+
+    def _span(self, string_id: int) -> slice:
+        return slice(self._offsets[string_id - 1] if string_id else 0, self._offsets[string_id])
+
+    def _equal(self, string_ids: np.ndarray, encoded: List[bytes]) -> np.ndarray:
+        """Compares the stored strings string_ids with the encoded values element-wise."""
+        ends = self._offsets[string_ids]
+        starts = np.where(string_ids > 0, self._offsets[string_ids - 1], 0)
+        lengths = np.array([len(value) for value in encoded], dtype=np.int64)
+        equal = ends - starts == lengths
+
+        # Gather the stored bytes of every non-empty string of matching length next to each other and
+        # count the mismatching bytes per string
+        selected = np.flatnonzero(equal & (lengths > 0))
+        if len(selected):
+            selected_lengths = lengths[selected]
+            value_starts = np.cumsum(selected_lengths) - selected_lengths
+            gather = np.repeat(starts[selected] - value_starts, selected_lengths) + np.arange(selected_lengths.sum())
+            values = np.frombuffer(b"".join(encoded[idx] for idx in selected), dtype=np.uint8)
+            mismatches = np.add.reduceat((self._data[gather] != values).astype(np.int64), value_starts)
+            equal[selected] = mismatches == 0
+        return equal
+
+    def append(self, encoded: List[bytes], hashes: np.ndarray = None) -> int:
+        """Appends UTF-8 encoded strings and returns the id of the first one.
+
+        hashes can be passed when they were already computed for find_many.
+        """
+        first_id = len(self)
+        if not encoded:
+            return first_id
+        base = os.path.getsize(self.data_path) if os.path.exists(self.data_path) else 0
+        ends = base + np.cumsum([len(value) for value in encoded], dtype="<i8")
+        with open(self.data_path, "ab") as f:
+            f.write(b"".join(encoded))
+        if self.hashes_path:
+            with open(self.hashes_path, "ab") as f:
+                (_string_hashes(encoded) if hashes is None else hashes).tofile(f)
+        with open(self.offsets_path, "ab") as f:
+            ends.tofile(f)
+        return first_id
+
+
+class SurveyResultStore:
+    """Append-only columnar store for generated surveys.
+
+    The store is a directory holding:
+    - strings.*: the StringTable that respondents, activities and variants are interned into
+    - question_texts.*: a StringTable with the text of every question; question texts are nearly all
+      unique, so they are stored once per question instead of being interned
+    - pairs.bin: fixed-width PAIR_DTYPE records
+    - questions.bin: fixed-width QUESTION_DTYPE records (question is an id into question_texts)
+
+    Everything is read back through np.memmap, so opening a store loads nothing and queries only page in
+    the columns and strings they touch. Writers look new strings up in bulk through the hash file instead
+    of keeping an index of the dictionary in memory. Use a single writer per store directory.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.pairs_path = os.path.join(path, "pairs.bin")
+        self.questions_path = os.path.join(path, "questions.bin")
+        self.strings = StringTable(path, "strings", hashed=True)
+        self.question_texts = StringTable(path, "question_texts")
+
+    def intern_many(self, values: Iterable[Optional[str]]) -> Dict[str, int]:
+        """Returns a mapping from each given string to its id, adding the strings not stored yet."""
+        unique = list(dict.fromkeys(value for value in values if value is not None))
+        encoded = [value.encode("utf-8") for value in unique]
+        hashes = _string_hashes(encoded)
+        string_ids = self.strings.find_many(encoded, hashes)
+        new = np.flatnonzero(string_ids == MISSING)
+        string_ids[new] = self.strings.append([encoded[idx] for idx in new], hashes[new]) + np.arange(len(new))
+        return dict(zip(unique, string_ids.tolist()))
+
+    def intern(self, value: Optional[str]) -> int:
+        """Returns the id of a string, adding it to the dictionary if needed."""
+        if value is None:
+            return MISSING
+        return self.intern_many([value])[value]
+
+    def lookup(self, value: str) -> int:
+        """Returns the id of a string without adding it, or MISSING if it was never stored."""
+        return self.strings.find(value)
+
+    def append_survey(self, respondent: str, survey: Dict) -> None:
+        """Appends one survey as returned by generate_personalized_survey."""
+        self.append_surveys([(respondent, survey)])
+
+    def append_surveys(self, surveys: Iterable[Tuple[str, Dict]]) -> None:
+        """Appends a batch of (respondent, survey) tuples with one write per file.
+
+        The strings of the whole batch are interned together, so the existing dictionary is searched once
+        per batch instead of being loaded into memory.
+        """
+        # Rows are collected with their strings first and converted to ids once the batch is interned
+        pair_rows = []
+        question_rows = []
+        question_texts = []
+        first_question_id = len(self.question_texts)
+        for respondent, survey in surveys:
+            for pair_type, list_key in PAIR_LIST_KEYS.items():
+                for pair in survey.get(list_key, []):
+                    pair_rows.append((
+                        respondent,
+                        pair.get("Activity"),
+                        PAIR_TYPE_CODES[pair_type],
+                        pair.get("Option_A", ""),
+                        pair.get("Option_B", ""),
+                    ))
+
+            questions = survey.get("Survey_Questions", [])
+            pair_types = survey.get("Question_Pair_Types", [])
+            activities = survey.get("Question_Activities", [])
+            for position, question in enumerate(questions):
+                pair_type = pair_types[position] if position < len(pair_types) else None
+                activity = activities[position] if position < len(activities) else None
+                question_rows.append((
+                    respondent,
+                    activity,
+                    PAIR_TYPE_CODES.get(pair_type, 255),
+                    position,
+                    first_question_id + len(question_texts),
+                ))
+                question_texts.append(question.encode("utf-8"))
+
+        # Strings go first so records never reference ids missing from the string tables on disk
+        strings = [value for row in pair_rows for value in (row[0], row[1], row[3], row[4])]
+        strings += [value for row in question_rows for value in row[:2]]
+        ids = self.intern_many(strings)
+        self.question_texts.append(question_texts)
+        if pair_rows:
+            with open(self.pairs_path, "ab") as f:
+                np.array([
+                    (ids.get(respondent, MISSING), ids.get(activity, MISSING), pair_type,
+                     ids.get(option_a, MISSING), ids.get(option_b, MISSING))
+                    for respondent, activity, pair_type, option_a, option_b in pair_rows
+                ], dtype=PAIR_DTYPE).tofile(f)
+        if question_rows:
+            with open(self.questions_path, "ab") as f:
+                np.array([
+                    (ids.get(respondent, MISSING), ids.get(activity, MISSING), pair_type, position, question)
+                    for respondent, activity, pair_type, position, question in question_rows
+                ], dtype=QUESTION_DTYPE).tofile(f)
+
+    def _load(self, path: str, dtype: np.dtype) -> np.ndarray:
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            return np.zeros(0, dtype=dtype)
+        count = os.path.getsize(path) // dtype.itemsize
+        return np.memmap(path, dtype=dtype, mode="r", shape=(count,))
+
+    def pairs(self) -> np.ndarray:
+        """Returns all pair records as a read-only memory-mapped structured array."""
+        return self._load(self.pairs_path, PAIR_DTYPE)
+
+    def questions(self) -> np.ndarray:
+        """Returns all question records as a read-only memory-mapped structured array."""
+        return self._load(self.questions_path, QUESTION_DTYPE)
+
+    def _select(self, records: np.ndarray, respondent: str = None, activity: str = None,
+                pair_type: str = None) -> np.ndarray:
+        mask = np.ones(len(records), dtype=bool)
+        for column, value in (("respondent", respondent), ("activity", activity)):
+            if value is None:
+                continue
+            string_id = self.lookup(value)
+            if string_id == MISSING:
+                return np.asarray(records[:0])
+            mask &= records[column] == string_id
+        if pair_type is not None:
+            mask &= records["pair_type"] == PAIR_TYPE_CODES[pair_type]
+        return np.asarray(records[mask])
+
+    def select_pairs(self, respondent: str = None, activity: str = None, pair_type: str = None) -> np.ndarray:
+        """Returns the integer-coded pair records matching all given filters."""
+        return self._select(self.pairs(), respondent, activity, pair_type)
+
+    def select_questions(self, respondent: str = None, activity: str = None, pair_type: str = None) -> np.ndarray:
+        """Returns the integer-coded question records matching all given filters."""
+        return self._select(self.questions(), respondent, activity, pair_type)
+
+    def _decode(self, string_id: int) -> Optional[str]:
+        return self.strings.get(int(string_id)) if string_id != MISSING else None
+
+    def query_pairs(self, respondent: str = None, activity: str = None, pair_type: str = None) -> List[Dict[str, str]]:
+        """Returns matching pairs decoded back to the dict layout used by generate_personalized_survey."""
+        return [
+            {
+                "Respondent": self._decode(row["respondent"]),
+                "Activity": self._decode(row["activity"]),
+                "Pair_Type": PAIR_TYPES[row["pair_type"]],
+                "Option_A": self._decode(row["option_a"]),
+                "Option_B": self._decode(row["option_b"]),
+            }
+            for row in self.select_pairs(respondent, activity, pair_type)
+        ]
+
+    def query_questions(self, respondent: str = None, activity: str = None, pair_type: str = None) -> List[Dict[str, str]]:
+        """Returns matching survey questions decoded to dicts."""
+        return [
+            {
+                "Respondent": self._decode(row["respondent"]),
+                "Activity": self._decode(row["activity"]),
+                "Pair_Type": PAIR_TYPES[row["pair_type"]] if row["pair_type"] < len(PAIR_TYPES) else None,
+                "Position": int(row["position"]),
+                "Question": self.question_texts.get(int(row["question"])),
+            }
+            for row in self.select_questions(respondent, activity, pair_type)
+        ]
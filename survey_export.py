@@ -0,0 +1,299 @@
+
+# survey_export.py
+import os
+import re
+import sys
+import json
+import uuid
+from datetime import datetime
+from typing import List, Dict, Iterable
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+
+SURVEY_FILE_SUFFIX = ".qsf"
+# Sidecar holding the generated survey (pairs, questions, pair types) next to each QSF file
+METADATA_SUFFIX = ".survey.json"
+
+
+def build_question_payload(question_text: str, idx: int) -> dict:
+    """Builds the single-answer multiple choice (MC/SAVR) payload used for every survey question."""
+    return {
+        "QuestionText": question_text,
+        "DataExportTag": f"Q{idx}",
+        "QuestionType": "MC",
+        "Selector": "SAVR",
+        "SubSelector": "TX",
+        "Configuration": {
+            "QuestionDescriptionOption": "UseText"
+        },
+        "Choices": {
+            "1": {"Display": "Option A"},
+            "2": {"Display": "Option B"}
+        },
+        "Validation": {
+            "Settings": {
+                "ForceResponse": "OFF",
+                "Type": "None"
+            }
+        }
+    }
+
+
+class QSFWriter:
+    """Streams one survey definition to disk in Qualtrics QSF format.
+
+    Questions are written as they are added; the block and flow elements that reference them are written
+    on close(). The file is written under a temporary name and renamed on close, so importers never see
+    a partial survey. Used as a context manager, the survey is closed on success and the temporary file
+    is removed if an exception is raised.
+    """
+
+    def __init__(self, path: str, name: str):
+        self.path = path
+        self.name = name
+        self.survey_id = "SV_" + uuid.uuid4().hex[:15]
+        self.question_ids: List[str] = []
+        self._tmp_path = path + ".part"
+        self._file = open(self._tmp_path, "w", encoding="utf-8")
+
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        survey_entry = {
+            "SurveyID": self.survey_id,
+            "SurveyName": name,
+            "SurveyDescription": None,
+            "SurveyOwnerID": None,
+            "SurveyBrandID": None,
+            "DivisionID": None,
+            "SurveyLanguage": "EN",
+            "SurveyActiveResponseSet": "RS_1",
+            "SurveyStatus": "Inactive",
+            "SurveyStartDate": "0000-00-00 00:00:00",
+            "SurveyExpirationDate": "0000-00-00 00:00:00",
+            "SurveyCreationDate": now,
+            "CreatorID": None,
+            "LastModified": now,
+            "LastAccessed": "0000-00-00 00:00:00",
+            "LastActivated": "0000-00-00 00:00:00",
+            "Deleted": None
+        }
+        self._file.write('{"SurveyEntry": ' + json.dumps(survey_entry) + ', "SurveyElements": [')
+        self._elements_written = 0
+
+    def __enter__(self) -> "QSFWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if self._file.closed:
+            return
+        if exc_type is not None:
+            self.abort()
+            return
+        try:
+            self.close()
+        except Exception:
+            self.abort()
+            raise
+
+    def abort(self) -> None:
+        """Discards the partially written survey."""
+        self._file.close()
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+
+    def _write_element(self, element: str, primary: str, payload, secondary: str = None) -> None:
+        if self._elements_written:
+            self._file.write(",\n")
+        self._file.write(json.dumps({
+            "SurveyID": self.survey_id,
+            "Element": element,
+            "PrimaryAttribute": primary,
+            "SecondaryAttribute": secondary,
+            "TertiaryAttribute": None,
+            "Payload": payload
+        }))
+        self._elements_written += 1
+
+    def add_question(self, question_text: str) -> str:
+        """Writes one survey question and returns its QuestionID."""
+        idx = len(self.question_ids) + 1
+        question_id = f"QID{idx}"
+        payload = build_question_payload(question_text, idx)
+        payload.update({
+            "QuestionDescription": question_text,
+            "ChoiceOrder": ["1", "2"],
+            "Language": [],
+            "QuestionID": question_id
+        })
+        self._write_element("SQ", question_id, payload, secondary=question_text[:100])
+        self.question_ids.append(question_id)
+        return question_id
+
+    def close(self) -> str:
+        """Writes the block, flow and options elements and moves the file into place."""
+        self._write_element("BL", "Survey Blocks", [{
+            "Type": "Default",
+            "Description": "Default Question Block",
+            "ID": "BL_1",
+            "BlockElements": [{"Type": "Question", "QuestionID": qid} for qid in self.question_ids]
+        }])
+        self._write_element("FL", "Survey Flow", {
+            "Type": "Root",
+            "FlowID": "FL_1",
+            "Flow": [{"Type": "Block", "ID": "BL_1", "FlowID": "FL_2"}],
+            "Properties": {"Count": 2}
+        })
+        self._write_element("SO", "Survey Options", {
+            "BackButton": "false",
+            "SaveAndContinue": "true",
+            "SurveyProtection": "PublicSurvey",
+            "BallotBoxStuffingPrevention": "false",
+            "NoIndex": "Yes",
+            "SurveyExpiration": "None",
+            "SurveyTermination": "DefaultMessage",
+            "Header": "",
+            "Footer": ""
+        })
+        self._file.write("]}\n")
+        self._file.close()
+        os.replace(self._tmp_path, self.path)
+        return self.path
+
+
+class QSFExportSink:
+    """Writes generated surveys to a directory as QSF files instead of creating them in Qualtrics.
+
+    Each survey produces <file>.qsf plus a <file>.survey.json sidecar with the generated survey dict, which
+    bulk_import() later updates with the Survey_ID and Survey_Link assigned by Qualtrics.
+    """
+
+    def __init__(self, output_dir: str):
+        self.output_dir = output_dir
+        os.makedirs(output_dir, exist_ok=True)
+
+    def open_survey(self, name: str, filename: str = None) -> QSFWriter:
+        if filename is None:
+            slug = re.sub(r"[^a-z0-9]+", "-", name.lower()).strip("-")
+            filename = f"{slug}-{uuid.uuid4().hex[:8]}"
+        return QSFWriter(os.path.join(self.output_dir, filename + SURVEY_FILE_SUFFIX), name)
+
+    def write_survey(self, name: str, survey: Dict, filename: str = None) -> str:
+        """Writes a survey as returned by generate_personalized_survey and returns the QSF path."""
+        with self.open_survey(name, filename) as writer:
+            for question_text in survey.get("Survey_Questions", []):
+                writer.add_question(question_text)
+        path = writer.path
+        write_survey_metadata(path, dict(survey, Survey_Name=name, Survey_File=path))
+        return path
+
+
+def metadata_path(qsf_path: str) -> str:
+    return qsf_path[:-len(SURVEY_FILE_SUFFIX)] + METADATA_SUFFIX
+
+
+def write_survey_metadata(qsf_path: str, survey: Dict) -> None:
+    with open(metadata_path(qsf_path), "w", encoding="utf-8") as f:
+        json.dump(survey, f, indent=2)
+
+
+def read_survey_metadata(qsf_path: str) -> Dict:
+    path = metadata_path(qsf_path)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def find_survey_files(export_dir: str, include_imported: bool = False, activate: bool = True) -> List[str]:
+    """Lists the QSF files in an export directory that still need work.
+
+    A file is pending if it was never imported, or (when activate is set) if its survey was imported but
+    not activated yet. include_imported lists every file.
+    """
+    paths = []
+    for filename in sorted(os.listdir(export_dir)):
+        if not filename.endswith(SURVEY_FILE_SUFFIX):
+            continue
+        path = os.path.join(export_dir, filename)
+        survey = read_survey_metadata(path)
+        pending = not survey.get("Survey_ID") or (activate and not survey.get("Activated"))
+        if include_imported or pending:
+            paths.append(path)
+    return paths
+
+
+def import_survey_file(qualtrics, qsf_path: str, activate: bool = True) -> Dict:
+    """Uploads one QSF file, optionally activates it and records the new survey in its sidecar.
+
+    The Survey_ID is recorded as soon as the import succeeds, so a file whose activation failed is only
+    activated, never imported a second time.
+    """
+    survey = read_survey_metadata(qsf_path)
+    name = survey.get("Survey_Name") or os.path.basename(qsf_path)[:-len(SURVEY_FILE_SUFFIX)]
+
+    survey_id = survey.get("Survey_ID")
+    if not survey_id:
+        import_response = qualtrics.import_survey(name, qsf_path)
+        survey_id = import_response.get("result", {}).get("id")
+        if not survey_id:
+            raise ValueError(f"Failed to import {qsf_path} - no survey id in response")
+        survey["Survey_ID"] = survey_id
+        survey["Survey_Link"] = qualtrics.get_distribution_link(survey_id)
+        survey["Activated"] = False
+        write_survey_metadata(qsf_path, survey)
+
+    if activate and not survey.get("Activated"):
+        if not qualtrics.activate_survey(survey_id):
+            raise ValueError(f"Failed to activate survey {survey_id}")
+        survey["Activated"] = True
+        write_survey_metadata(qsf_path, survey)
+    return survey
+
+
+def bulk_import(qualtrics, qsf_paths: Iterable[str], max_workers: int = 8, activate: bool = True) -> List[Dict]:
+    """Uploads many QSF files to Qualtrics concurrently.
+
+    Returns one dict per file with Survey_File plus either Survey_ID/Survey_Link or Error.
+    Files that failed to import or to activate are picked up again by find_survey_files on the next run.
+    """
+    results = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(import_survey_file, qualtrics, path, activate): path for path in qsf_paths}
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                survey = future.result()
+                results.append({
+                    "Survey_File": path,
+                    "Survey_ID": survey["Survey_ID"],
+                    "Survey_Link": survey["Survey_Link"]
+                })
+            except Exception as e:
+                print(f"Error importing {path}: {str(e)}")
+                results.append({"Survey_File": path, "Error": str(e)})
+    return results
+
+
+if __name__ == "__main__":
+    # Usage: python survey_export.py <export_dir> [max_workers]
+    from dotenv import load_dotenv
+    from qualtrics_api import QualtricsAPI
+
+    load_dotenv()
+    if len(sys.argv) < 2:
+        print("Usage: python survey_export.py <export_dir> [max_workers]")
+        sys.exit(1)
+    if not os.getenv("QUALTRICS_API_TOKEN"):
+        raise EnvironmentError("Missing required environment variables: QUALTRICS_API_TOKEN")
+
+    export_dir = sys.argv[1]
+    max_workers = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    qualtrics = QualtricsAPI(api_token=os.getenv("QUALTRICS_API_TOKEN"))
+
+    paths = find_survey_files(export_dir)
+    print(f"Importing {len(paths)} surveys from {export_dir} with {max_workers} workers.")
+    results = bulk_import(qualtrics, paths, max_workers=max_workers)
+    failed = [r for r in results if "Error" in r]
+    print(f"Imported {len(results) - len(failed)} surveys, {len(failed)} failed.")
+    for result in results:
+        if "Survey_Link" in result:
+            print(f"{result['Survey_File']}: {result['Survey_Link']}")